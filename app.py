@@ -1,12 +1,19 @@
+import hashlib
+import json
 import os
 import sys
 import time
 import logging
-from threading import Thread, Lock
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from threading import Lock
+from typing import Optional, List, Dict, Any, Tuple
 
 import prawcore
-from flask import Flask, render_template, request, make_response, redirect, url_for, jsonify
+from apscheduler.schedulers.background import BackgroundScheduler
+from celery import Celery
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from flask import Flask, Response, render_template, request, make_response, redirect, url_for, jsonify
 from flask_caching import Cache
 
 from predictor_logic import BannerManager, get_community_sentiment_score
@@ -24,34 +31,36 @@ SENTIMENT_LOCK_TIMEOUT = 60 * 60 * 4  # 4 hours (keep lock for full cache lifeti
 CACHE_TIMEOUT_SENTIMENT = 60 * 60 * 4  # 4 hours
 
 GLOBAL_SENTIMENT_LOCK_KEY = "sentiment_global_lock"
+SENTIMENT_VERSION_KEY = "sentiment_version"
+SENTIMENT_CHANNEL = "sentiment_updates"
+
+SENTIMENT_WORKER_THREADS = 4  # beyond ~4 Reddit starts returning 429s faster than we gain
 
 app.config.from_mapping({
     "DEBUG": True,
-    "CACHE_TYPE": "SimpleCache",
+    "CACHE_TYPE": "RedisCache",  # shared across Gunicorn workers (SimpleCache was per-process)
+    "CACHE_REDIS_URL": os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+    "CACHE_KEY_PREFIX": "ba:",
     "CACHE_DEFAULT_TIMEOUT": 3600
 })
 cache = Cache(app)
 
-start_thread_lock = Lock()  # prevents race starting the worker thread (per-process)
-sentiment_thread: Optional[Thread] = None  # holds Thread instance when running (per-process)
+celery_app = Celery("ba", broker=os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
 
 
 def _is_global_sentiment_running() -> bool:
-    global sentiment_thread
-    try:
-        if sentiment_thread is not None and sentiment_thread.is_alive():
-            return True
-    except Exception:
-        logger.exception("Error checking local sentiment thread status; falling back to cache lock check.")
+    # The worker runs in a Celery process now, so the cache lock is the only
+    # authority on whether a refresh is in flight.
     return cache.get(GLOBAL_SENTIMENT_LOCK_KEY) is not None
 
 
 def _try_acquire_global_sentiment_lock() -> bool:
     try:
-        if cache.get(GLOBAL_SENTIMENT_LOCK_KEY):
-            return False
-        cache.set(GLOBAL_SENTIMENT_LOCK_KEY, True, timeout=CACHE_TIMEOUT_SENTIMENT)
-        return True
+        # Atomic SET NX EX on the raw Redis client: the old get-then-set had a
+        # window where two workers could both "win" and start duplicate scrapers.
+        client = cache.cache._write_client
+        key = cache.cache.key_prefix + GLOBAL_SENTIMENT_LOCK_KEY
+        return bool(client.set(key, b"1", nx=True, ex=CACHE_TIMEOUT_SENTIMENT))
     except Exception:
         logger.exception("Failed to set global sentiment cache lock.")
         return False
@@ -66,72 +75,132 @@ def _release_global_sentiment_lock():
 
 def _cache_sentiment_data(unit_key: str, data: dict):
     try:
-        cache.set(f"sentiment_data:{unit_key}", data, timeout=CACHE_TIMEOUT_SENTIMENT)
+        # timeout=0 -> no expiry: entries stay serveable until the scheduled
+        # refresh overwrites them, so clients never see data vanish mid-cycle.
+        cache.set(f"sentiment_data:{unit_key}", data, timeout=0)
+        client = cache.cache._write_client
+        client.incr(cache.cache.key_prefix + SENTIMENT_VERSION_KEY)
+        client.publish(SENTIMENT_CHANNEL, json.dumps({"units": unit_key, **data}))
     except Exception:
         logger.exception("Failed to cache sentiment data for %s", unit_key)
 
 
-def _get_cached_sentiment_data(unit_key: str):
+def _get_sentiment_version() -> int:
+    try:
+        raw = cache.cache._read_client.get(cache.cache.key_prefix + SENTIMENT_VERSION_KEY)
+        return int(raw or 0)
+    except Exception:
+        logger.exception("Failed to read sentiment version.")
+        return 0
+
+
+def _get_cached_sentiment_bulk(banners) -> List[Optional[dict]]:
+    """Fetch all sentiment entries in one MGET round-trip instead of one per banner."""
     try:
-        return cache.get(f"sentiment_data:{unit_key}")
+        return list(cache.get_many(*[banner.sentiment_cache_key for banner in banners]))
     except Exception:
-        logger.exception("Failed to fetch cached sentiment data for %s", unit_key)
-        return None
+        logger.exception("Failed to bulk-fetch cached sentiment data.")
+        return [None] * len(banners)
+
+
+@retry(
+    retry=retry_if_exception_type(prawcore.exceptions.TooManyRequests),
+    wait=wait_exponential(min=30, max=600),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+def _get_sentiment_with_retry(unit_key: str):
+    return get_community_sentiment_score(unit_key)
 
 
-def update_all_sentiments_background():
+def _process_one_banner(banner) -> Tuple[str, Dict[str, Any]]:
+    """Compute and cache sentiment for a single banner; returns (unit_key, data)."""
+    unit_key = banner.unit_key
+    score_count = None
+    try:
+        score_count = _get_sentiment_with_retry(unit_key)
+    except prawcore.exceptions.TooManyRequests:
+        logger.exception("Failed sentiment for %s", unit_key)
+
+    if isinstance(score_count, tuple) and len(score_count) >= 2:
+        score, count = score_count[0], score_count[1]
+    elif isinstance(score_count, dict):
+        score = score_count.get("score")
+        count = score_count.get("count", 0)
+    else:
+        score = score_count
+        count = 0
+
+    data = {'score': score if score is not None else 'N/A', 'count': int(count or 0)}
+    _cache_sentiment_data(unit_key, data)
+    return unit_key, data
+
+
+@celery_app.task(bind=True, acks_late=True)
+def update_all_sentiments_background(self):
     """
     Compute sentiment for each banner and write incremental results to cache.
-    This function assumes the cache lock has already been set (owner).
+    This task assumes the cache lock has already been set (owner).
+
+    Run the worker with: celery -A app.celery_app worker -c 1 --max-tasks-per-child=50
     """
-    global sentiment_thread
-    logger.info("[THREAD] Global sentiment worker started.")
+    logger.info("[WORKER] Global sentiment worker started.")
     try:
         manager = get_banner_manager()
         total = len(manager.merged_banners) if manager and getattr(manager, "merged_banners", None) else 0
 
-        for idx, banner in enumerate(manager.merged_banners, start=1):
-            unit_key = " ".join(banner.units) if hasattr(banner, "units") else getattr(banner, "id", str(idx))
-            score_count = None
-            try:
-                score_count = get_community_sentiment_score(unit_key)
-            except prawcore.exceptions.TooManyRequests:
-                logger.exception("Failed sentiment for %s", unit_key)
-                time.sleep(300)
-
-            if isinstance(score_count, tuple) and len(score_count) >= 2:
-                score, count = score_count[0], score_count[1]
-            elif isinstance(score_count, dict):
-                score = score_count.get("score")
-                count = score_count.get("count", 0)
-            else:
-                score = score_count
-                count = 0
-
-            data = {'score': score if score is not None else 'N/A', 'count': int(count or 0)}
-            _cache_sentiment_data(unit_key, data)
-            logger.info("[%d/%d] Updated %s: %s", idx, total, unit_key, data)
-        logger.info("[THREAD] Global sentiment worker finished successfully.")
+        # Per-banner work is almost entirely PRAW I/O, so a small thread pool
+        # overlaps the network waits; the shared Reddit client still enforces
+        # the aggregate rate limit.
+        with ThreadPoolExecutor(max_workers=SENTIMENT_WORKER_THREADS) as executor:
+            futures = {executor.submit(_process_one_banner, banner): banner
+                       for banner in manager.merged_banners}
+            for idx, future in enumerate(as_completed(futures), start=1):
+                try:
+                    unit_key, data = future.result()
+                    logger.info("[%d/%d] Updated %s: %s", idx, total, unit_key, data)
+                except Exception:
+                    logger.exception("Unhandled error processing banner %s", futures[future])
+        logger.info("[WORKER] Global sentiment worker finished successfully.")
     except Exception:
-        logger.exception("[THREAD ERROR] Unhandled exception in sentiment worker")
+        logger.exception("[WORKER ERROR] Unhandled exception in sentiment worker")
     finally:
         try:
             _release_global_sentiment_lock()
-            logger.info("[THREAD] Global lock released.")
+            logger.info("[WORKER] Global lock released.")
         except Exception:
-            logger.exception("[THREAD] Error releasing global lock.")
+            logger.exception("[WORKER] Error releasing global lock.")
+        try:
+            # Terminal event so SSE subscribers know the run is over and can
+            # close their stream instead of waiting on a dead channel.
+            cache.cache._write_client.publish(SENTIMENT_CHANNEL, json.dumps({"done": True}))
+        except Exception:
+            logger.exception("[WORKER] Error publishing completion event.")
 
 
-@cache.memoize(timeout=3600)
-def get_banner_manager() -> BannerManager:
-    """
-    Load or construct BannerManager and cache the instance for repeated requests.
-    The function must return a BannerManager object with at least:
-      - merged_banners attribute (iterable of banner objects)
-      - get_filtered_banners(search_query) method
-    """
+def _schedule_sentiment_refresh():
+    """Enqueue the sentiment worker unless a run is already in flight."""
+    if _try_acquire_global_sentiment_lock():
+        try:
+            update_all_sentiments_background.apply_async()
+        except Exception:
+            # Broker down: give the lock back, or refreshes stay blocked for
+            # the full lock TTL even though no worker is running.
+            logger.exception("Failed to enqueue sentiment refresh; releasing lock.")
+            _release_global_sentiment_lock()
+            return
+        logger.info("Scheduled sentiment refresh enqueued.")
+    else:
+        logger.debug("Sentiment refresh already in flight; skipping scheduled run.")
+
+
+_MANAGER: Optional[BannerManager] = None
+_MANAGER_LOCK = Lock()
+
+
+def _build_manager() -> BannerManager:
     start_time = time.time()
-    logger.info("Starting banner parsing (cache-miss)...")
+    logger.info("Starting banner parsing...")
     manager = BannerManager()
     try:
         manager.load_data()
@@ -142,6 +211,43 @@ def get_banner_manager() -> BannerManager:
     return manager
 
 
+def get_banner_manager() -> BannerManager:
+    """
+    Return the per-process BannerManager singleton, building it on first use.
+    Readers are lock-free after the first load; the scheduler swaps in a fresh
+    instance periodically. The object must provide at least:
+      - merged_banners attribute (iterable of banner objects)
+      - get_filtered_banners(search_query) method
+    """
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = _build_manager()
+    return _MANAGER
+
+
+def _reload_manager():
+    """Build a fresh manager off-request, then atomically swap it in."""
+    global _MANAGER
+    manager = _build_manager()
+    old_manager, _MANAGER = _MANAGER, manager
+    if old_manager is not None:
+        old_manager.close()  # release the replaced manager's connection pool
+
+
+# Refresh proactively: sentiment entries (which never expire) are replaced
+# every 3h before they go stale instead of letting a TTL expiry stampede the
+# first request, and the banner manager is rebuilt hourly off-request.
+scheduler = BackgroundScheduler()
+# next_run_time: interval jobs otherwise first fire a full interval after
+# start, which would leave a fresh deployment without sentiment for 3 hours.
+scheduler.add_job(_schedule_sentiment_refresh, 'interval', hours=3, max_instances=1, coalesce=True,
+                  next_run_time=datetime.now())
+scheduler.add_job(_reload_manager, 'interval', hours=1, max_instances=1, coalesce=True)
+scheduler.start()
+
+
 @app.route('/')
 def index():
     try:
@@ -149,28 +255,51 @@ def index():
         search_query = request.args.get('search', '')
         theme = request.cookies.get('theme', 'light')
         filtered_banners = manager.get_filtered_banners(search_query)
-        return render_template(
+        response = make_response(render_template(
             'index.html',
             banners=filtered_banners,
             search_query=search_query,
             theme=theme,
             total_banners=len(manager.merged_banners)
-        )
+        ))
+        # private: the rendered page embeds the per-user theme cookie, so only
+        # the browser may cache it.
+        response.headers["Cache-Control"] = "private, max-age=30"
+        return response
     except Exception:
         logger.exception("Error rendering index.")
         return "Internal server error", 500
 
 
+def _search_etag(search_query: str, data_version: int) -> str:
+    return hashlib.blake2b(f"{search_query}:{data_version}".encode(), digest_size=8).hexdigest()
+
+
+@cache.memoize(timeout=60)
+def _render_search_rows(search_query: str, data_version: int) -> str:
+    # data_version is part of the memoize key so a banner reload invalidates
+    # every cached rendering at once.
+    manager = get_banner_manager()
+    return render_template(
+        'partials/table_rows.html',
+        banners=manager.get_filtered_banners(search_query)
+    )
+
+
 @app.route('/search-api')
 def search_api():
     try:
         manager = get_banner_manager()
         search_query = request.args.get('search', '')
-        filtered_banners = manager.get_filtered_banners(search_query)
-        return render_template(
-            'partials/table_rows.html',
-            banners=filtered_banners
-        )
+
+        etag = _search_etag(search_query, manager.data_version)
+        if etag in request.if_none_match:
+            return "", 304
+
+        response = make_response(_render_search_rows(search_query, manager.data_version))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, max-age=30"
+        return response
     except Exception:
         logger.exception("Error in search-api.")
         return "Internal server error", 500
@@ -189,49 +318,66 @@ def set_theme(theme_name: str):
 @app.route('/api/sentiment')
 def get_sentiment_scores():
     """
-    Return currently cached sentiment data (partial) and ensure exactly one
-    background worker is started (per-process) to fill missing data.
+    Return currently cached sentiment data. Refreshes are driven by the
+    background scheduler, not by requests.
     """
-    global sentiment_thread
+    version = _get_sentiment_version()
+    since = request.args.get("since", type=int)
+    if since is not None and since == version:
+        # Nothing changed since the client's last poll; skip the banner scan
+        # and the bulk cache fetch entirely.
+        return jsonify({
+            "version": version,
+            "running": _is_global_sentiment_running(),
+            "count_cached": 0,
+            "data": []
+        })
 
     try:
         manager = get_banner_manager()
     except Exception:
         logger.exception("Failed to get banner manager for sentiment API.")
-        return jsonify({"running": False, "count_cached": 0, "data": []}), 500
-
-    sentiment_results: List[Dict[str, Any]] = []
-
-    for banner in manager.merged_banners:
-        unit_key = " ".join(banner.units)
-        cached_data = _get_cached_sentiment_data(unit_key)
-        if cached_data:
-            sentiment_results.append({'units': unit_key, **cached_data})
-
-    with start_thread_lock:
-        already_running = _is_global_sentiment_running()
-        if not already_running:
-            got_cache_lock = _try_acquire_global_sentiment_lock()
-            if got_cache_lock:
-                sentiment_thread = Thread(
-                    target=update_all_sentiments_background,
-                    name="GlobalSentimentWorker",
-                    daemon=True
-                )
-                sentiment_thread.start()
-                logger.info("Started global sentiment background thread.")
-            else:
-                logger.info("Cache lock acquired by another actor; not starting thread.")
-        else:
-            logger.debug("Sentiment update already running, skipping new one.")
+        return jsonify({"version": version, "running": False, "count_cached": 0, "data": []}), 500
+
+    banners = manager.merged_banners
+    sentiment_results: List[Dict[str, Any]] = [
+        {'units': banner.unit_key, **cached_data}
+        for banner, cached_data in zip(banners, _get_cached_sentiment_bulk(banners))
+        if cached_data
+    ]
 
     return jsonify({
+        "version": version,
         "running": _is_global_sentiment_running(),
         "count_cached": len(sentiment_results),
         "data": sentiment_results
     })
 
 
+@app.route('/api/sentiment/stream')
+def sentiment_stream():
+    """
+    Push each sentiment update to the client as a Server-Sent Event.
+    Clients load the /api/sentiment snapshot once, then hold this stream open
+    instead of polling while the worker fills the cache.
+    """
+    def event_stream():
+        pubsub = cache.cache._read_client.pubsub()
+        pubsub.subscribe(SENTIMENT_CHANNEL)
+        try:
+            for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                payload = message["data"]
+                if isinstance(payload, bytes):
+                    payload = payload.decode("utf-8", "replace")
+                yield f"data: {payload}\n\n"
+        finally:
+            pubsub.close()
+
+    return Response(event_stream(), mimetype="text/event-stream")
+
+
 if __name__ == '__main__':
     is_debug = os.environ.get("DEBUG", "0").lower() in ("true", "1", "t")
     host = os.environ.get("HOST", "0.0.0.0")
@@ -1,16 +1,24 @@
 import os
+import pickle
 import re
 import sys
-import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Tuple, Optional
 
+import ahocorasick
 import praw
+import redis
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from praw.models import Submission
+from praw.models import MoreComments, Submission
 
 TARGET_SUBREDDIT = "BlueArchive"
 POST_LIMIT_PER_UNIT = 50
-COMMENT_DEPTH = 5
+ANALYSIS_WORKER_THREADS = 8  # concurrent comment-tree fetches per unit
+MORECHILDREN_BATCH = 100  # ids per /api/morechildren call (API maximum)
+MAX_COMMENTS_PER_THREAD = 200  # enough signal for an average; stop scanning beyond this
+MAX_SCORED_BODY_CHARS = 2000  # VADER >=3.3.1 blows up quadratically on emoticon-heavy walls of text
+MIN_COMMENTS_FOR_SIGNAL = 20  # below this, pay for the deeper "load more" expansion
+THREAD_CACHE_TTL = 60 * 60 * 24  # 24h; the key embeds num_comments, so new activity invalidates early
 ASSESSMENT_KEYWORDS = [
     'tier', 'ranking', 'review', 'analysis', 'impressions',
     'worth', 'pull', 'skip', 'roll', 'summon', '"must pull"',
@@ -51,6 +59,10 @@ GAMEPLAY_FOCUS_KEYWORDS = [
     'Pyroxene', 'Pyro', 'Eleph', 'shard',
     'F2P', 'whale', 'farm', 'grind', 'sweep'
 ]
+# Case-folded once at import; everything downstream (the keyword automaton)
+# works on these so needle normalization never runs per comment.
+GAMEPLAY_FOCUS_SET = frozenset(kw.lower() for kw in GAMEPLAY_FOCUS_KEYWORDS)
+AESTHETIC_FILTER_SET = frozenset(kw.lower() for kw in AESTHETIC_FILTER_KEYWORDS)
 VADER_CUSTOM_LEXICON = {
     'must pull': 3.5,
     'broken': 3.5,
@@ -97,7 +109,33 @@ VADER_CUSTOM_LEXICON = {
 }
 
 analyzer = SentimentIntensityAnalyzer()
-analyzer.lexicon.update(VADER_CUSTOM_LEXICON)
+# Rebind one merged dict instead of mutating VADER's in place. Keys are short
+# ASCII tokens, so interning lets the hot lexicon probes in polarity_scores
+# hit the pointer-equality fast path. Read-only after init - never mutate it,
+# or the worker threads sharing the analyzer would race.
+analyzer.lexicon = {sys.intern(k): v
+                    for k, v in {**analyzer.lexicon, **VADER_CUSTOM_LEXICON}.items()}
+
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """One Aho-Corasick automaton for both keyword lists, so each comment body
+    is scanned once instead of ~70 Python-level substring searches. Some
+    keywords ('meta', 'L2D', ...) appear in both lists, so values are tag sets.
+    """
+    tags_by_word = {}
+    for kw in GAMEPLAY_FOCUS_SET:
+        tags_by_word.setdefault(kw, set()).add("game")
+    for kw in AESTHETIC_FILTER_SET:
+        tags_by_word.setdefault(kw, set()).add("aes")
+
+    automaton = ahocorasick.Automaton()
+    for word, tags in tags_by_word.items():
+        automaton.add_word(word, frozenset(tags))
+    automaton.make_automaton()
+    return automaton
+
+
+_keyword_automaton = _build_keyword_automaton()
 
 
 def get_auth_details():
@@ -126,7 +164,8 @@ try:
         client_secret=CLIENT_SECRET,
         user_agent=USER_AGENT,
         username=REDDIT_USERNAME,
-        password=REDDIT_PASSWORD
+        password=REDDIT_PASSWORD,
+        ratelimit_seconds=600  # let PRAW sleep through server-side rate limits itself
     )
     print(f"✅ Reddit PRAW client initialized.")
 except Exception as e:
@@ -134,73 +173,186 @@ except Exception as e:
     sys.exit(1)
 
 
+def _run_search(query: str) -> List[Submission]:
+    print(f"-> Searching: {query}")
+    return list(reddit.subreddit(TARGET_SUBREDDIT).search(
+        query=query,
+        sort='top',
+        time_filter='year',
+        limit=POST_LIMIT_PER_UNIT
+    ))
+
+
 def _get_relevant_submissions(unit_name: str) -> List[Submission]:
-    submissions = []
     keywords_part = " OR ".join(ASSESSMENT_KEYWORDS)
 
     query_exact = f'"{unit_name}" AND ({keywords_part})'
 
-    print(f"-> Searching EXACT: {query_exact}")
-    submissions_exact = reddit.subreddit(TARGET_SUBREDDIT).search(
-        query=query_exact,
-        sort='top',
-        time_filter='year',
-        limit=POST_LIMIT_PER_UNIT
-    )
-    submissions.extend(list(submissions_exact))
-
-    if len(submissions) < 5:
-        base_name = unit_name.split('(')[0].strip()
-        query_base = f'"{base_name}" AND ({keywords_part})'
-
-        print(f"-> Searching BASE: {query_base}")
-        submissions_base = reddit.subreddit(TARGET_SUBREDDIT).search(
-            query=query_base,
-            sort='top',
-            time_filter='year',
-            limit=POST_LIMIT_PER_UNIT
-        )
+    base_name = unit_name.split('(')[0].strip()
+    if base_name == unit_name:
+        return _run_search(query_exact)
 
-        unique_submissions = set(submissions)
-        for sub in submissions_base:
-            if sub not in unique_submissions:
-                submissions.append(sub)
-                unique_submissions.add(sub)
-    time.sleep(0.5)
-    return submissions
+    query_base = f'"{base_name}" AND ({keywords_part})'
 
+    # The exact and base-name searches are independent HTTP round-trips;
+    # issuing them concurrently halves the search latency per unit.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        exact_future = executor.submit(_run_search, query_exact)
+        base_future = executor.submit(_run_search, query_base)
+        exact, base = exact_future.result(), base_future.result()
 
-def _analyze_comments(submission: Submission) -> Tuple[float, int]:
-    submission.comments.replace_more(limit=COMMENT_DEPTH)
+    # Dedup by submission id while keeping exact-match hits first.
+    return list({sub.id: sub for sub in exact + base}.values())
 
-    total_polarity = 0
-    comment_count = 0
 
-    seen_comments = set()
+# Shared scoring pool: created once at import so the fork cost is amortized
+# across all submissions (workers are only spawned on first use).
+_scoring_pool = ProcessPoolExecutor()
+
+_thread_cache = redis.Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+
+
+def _get_cached_thread_sentiment(key: str) -> Optional[Tuple[float, int]]:
+    try:
+        raw = _thread_cache.get(key)
+    except Exception as e:
+        print(f"Thread sentiment cache read failed: {e}", file=sys.stderr)
+        return None
+    return pickle.loads(raw) if raw else None
+
 
-    for comment in submission.comments.list():
-        if comment.id in seen_comments or comment.body is None:
+def _cache_thread_sentiment(key: str, result: Tuple[float, int]):
+    try:
+        _thread_cache.set(key, pickle.dumps(result), ex=THREAD_CACHE_TTL)
+    except Exception as e:
+        print(f"Thread sentiment cache write failed: {e}", file=sys.stderr)
+
+
+def _score_body(body: str) -> dict:
+    return analyzer.polarity_scores(body)
+
+
+def _collect_scorable_comments(comments, seen_comments: set, bodies: List[str], weights: List[int]):
+    """Append the bodies/weights of comments that pass the keyword filters,
+    capped at MAX_COMMENTS_PER_THREAD kept comments overall."""
+    # Hoist attribute lookups out of the hot loop: each dotted access is a
+    # dict probe, and this loop runs for every comment of every thread.
+    seen_add = seen_comments.add
+    for comment in comments:
+        if len(bodies) >= MAX_COMMENTS_PER_THREAD:
+            break
+
+        # Cheapest, most-selective gates first: most comments fail on the body
+        # alone, and touching .id/.score can trigger PRAW lazy loads.
+        body = comment.body
+        if not body or len(body) < 11 or body.startswith('The body of the comment is'):
+            continue
+
+        comment_id = comment.id
+        if comment_id in seen_comments:
             continue
+        seen_add(comment_id)
+
+        body_lower = body.lower()
 
-        seen_comments.add(comment.id)
+        tags = set()
+        for _, keyword_tags in _keyword_automaton.iter(body_lower):
+            tags |= keyword_tags
+            if "aes" in tags:
+                break  # aesthetic comments are filtered out regardless
 
-        if comment.body and len(comment.body) > 10 and not comment.body.startswith('The body of the comment is'):
-            is_gameplay_context = any(kw in comment.body.lower() for kw in GAMEPLAY_FOCUS_KEYWORDS)
+        if "game" not in tags or "aes" in tags:
+            continue
 
-            if not is_gameplay_context:
-                continue
+        score = comment.score
+        # Truncate before scoring: a single pathological (all-emoticon)
+        # comment can otherwise stall VADER for minutes.
+        bodies.append(body[:MAX_SCORED_BODY_CHARS])
+        weights.append(score if score > 0 else 1)
+
+
+def _iter_comment_tree(forest):
+    """Yield comments depth-first without flattening the whole forest.
+
+    CommentForest.list() materializes every Comment up front; big threads run
+    to 10k+ comments while the collector keeps at most MAX_COMMENTS_PER_THREAD,
+    so streaming lets its early break skip the bulk of a giant tree.
+    """
+    stack = list(forest)
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(comment.replies)
+
+
+def _fetch_more_comments(submission: Submission, more_nodes) -> List:
+    """
+    Resolve the children of dropped MoreComments nodes with batched
+    /api/morechildren calls - one HTTP request per 100 ids instead of one
+    request per "load more" node the way replace_more expands them.
+    """
+    child_ids: List[str] = []
+    for node in more_nodes:
+        child_ids.extend(node.children)
+
+    comments: List = []
+    for start in range(0, len(child_ids), MORECHILDREN_BATCH):
+        batch = child_ids[start:start + MORECHILDREN_BATCH]
+        try:
+            fetched = reddit.post('/api/morechildren', data={
+                'link_id': submission.fullname,
+                'children': ','.join(batch),
+                'api_type': 'json',
+            })
+        except Exception as e:
+            print(f"morechildren batch failed for {submission.id}: {e}", file=sys.stderr)
+            continue
+        if isinstance(fetched, list):
+            # morechildren can return further MoreComments stubs alongside
+            # real comments; .body on a stub raises, so drop them here.
+            comments.extend(c for c in fetched if not isinstance(c, MoreComments))
+    return comments
 
-            is_aesthetic = any(keyword in comment.body.lower() for keyword in AESTHETIC_FILTER_KEYWORDS)
-            if is_aesthetic:
-                continue
 
-            vs = analyzer.polarity_scores(comment.body)
-            weight = comment.score if comment.score > 0 else 1
+def _analyze_comments(submission: Submission) -> Tuple[float, int]:
+    # Popular threads barely change between refreshes; reuse the previous
+    # analysis (and skip the expensive replace_more fetch) while the comment
+    # count is unchanged.
+    cache_key = f"ba:thread:{submission.id}:{submission.num_comments}"
+    cached = _get_cached_thread_sentiment(cache_key)
+    if cached is not None:
+        return cached
 
-            if abs(vs['compound']) > 0.1:
-                total_polarity += vs['compound'] * weight
-                comment_count += weight
+    print(f"-> Analyzing thread: {submission.title} ({submission.url})")
 
+    # Drop MoreComments on the first sweep: the top of the tree usually holds
+    # enough signal, and each "load more" expansion is an extra HTTP call.
+    more_nodes = submission.comments.replace_more(limit=0)
+
+    seen_comments = set()
+    bodies: List[str] = []
+    weights: List[int] = []
+
+    _collect_scorable_comments(_iter_comment_tree(submission.comments), seen_comments, bodies, weights)
+
+    if len(bodies) < MIN_COMMENTS_FOR_SIGNAL and more_nodes:
+        _collect_scorable_comments(
+            _fetch_more_comments(submission, more_nodes),
+            seen_comments, bodies, weights
+        )
+
+    total_polarity = 0
+    comment_count = 0
+
+    # VADER scoring is pure CPU; spread the batch over the process pool and
+    # reduce the weighted compounds back on this thread.
+    for vs, weight in zip(_scoring_pool.map(_score_body, bodies, chunksize=32), weights):
+        compound = vs['compound']
+        if abs(compound) > 0.1:
+            total_polarity += compound * weight
+            comment_count += weight
+
+    _cache_thread_sentiment(cache_key, (total_polarity, comment_count))
     return total_polarity, comment_count
 
 
@@ -216,19 +368,21 @@ def get_community_sentiment_score(unit_name: str) -> Tuple[Optional[float], int]
     overall_polarity = 0
     overall_count = 0
 
-    for sub in submissions:
-        # if 'daily questions megathread' in sub.title.lower() or 'daily advice megathread' in sub.title.lower():
-        #     print(f"-> Skipping MegaThread: {sub.title}")
-        #     continue
+    # Megathread filter intentionally disabled:
+    # submissions = [sub for sub in submissions
+    #                if 'daily questions megathread' not in sub.title.lower()
+    #                and 'daily advice megathread' not in sub.title.lower()]
 
-        print(f"-> Analyzing thread: {sub.title} ({sub.url})")
-        thread_polarity, thread_count = _analyze_comments(sub)
+    # Each analysis blocks on Reddit round-trips (replace_more + comment
+    # fetches), so fan the submissions out over threads; the shared PRAW
+    # client still serializes through its internal rate limiter.
+    with ThreadPoolExecutor(max_workers=ANALYSIS_WORKER_THREADS) as executor:
+        results = list(executor.map(_analyze_comments, submissions))
 
+    for thread_polarity, thread_count in results:
         overall_polarity += thread_polarity
         overall_count += thread_count
 
-        time.sleep(1)
-
     if overall_count == 0:
         return None, 0
 
@@ -1,22 +1,60 @@
+import os
+import pickle
+import re
 import sys
-from dataclasses import dataclass
+import time
+from collections import defaultdict, deque
+from html import unescape
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import List, Optional, Tuple, Dict, Any
 from community_scraper import get_community_sentiment_score
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 ASIA_URL = "https://bluearchive.wiki/wiki/Banner_List"
 GLOBAL_URL = "https://bluearchive.wiki/wiki/Banner_List_(Global)"
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                  'Chrome/100.0.4896.88 Safari/537.36'
+                  'Chrome/100.0.4896.88 Safari/537.36',
+    # The banner pages are large, repetitive HTML; urllib3 decompresses
+    # transparently, so this is pure bandwidth savings.
+    'Accept-Encoding': 'gzip, deflate',
 }
 DATE_FORMAT = "%Y/%m/%d %H:%M"
+QUERY_CACHE_SIZE = 256  # distinct filter strings kept per manager
+BANNER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache")
 
+# Grabs each wikitable fragment so only the banner table(s) get parsed into a
+# DOM, not the surrounding navboxes/sidebars/scripts of the full page.
+_WIKITABLE_RE = re.compile(r'<table[^>]*\bwikitable\b[\s\S]*?</table>', re.IGNORECASE)
 
-@dataclass(frozen=True)
+# Row scanner specialized to the known banner-table shape
+# (image | units [+ small "rerun"] | "start — end"); see _parse_banners_fast.
+_TR_RE = re.compile(r'<tr([^>]*)>([\s\S]*?)</tr>', re.IGNORECASE)
+_TD_SPLIT_RE = re.compile(r'<td[^>]*>', re.IGNORECASE)
+_RELEASE_RE = re.compile(r'data-release="([^"]*)"')
+_IMG_SRC_RE = re.compile(r'<img[^>]+src="([^"]+)"', re.IGNORECASE)
+_ANCHOR_TEXT_RE = re.compile(r'<a[^>]*>([^<]+)</a>', re.IGNORECASE)
+_SMALL_RE = re.compile(r'<small[^>]*>([^<]*)</small>', re.IGNORECASE)
+_DATE_RANGE_RE = re.compile(r'(\d{4}/\d{2}/\d{2} \d{2}:\d{2})\s*—\s*(\d{4}/\d{2}/\d{2} \d{2}:\d{2})')
+
+# In-process layer over the on-disk ETag cache; module-level so it survives
+# the hourly manager rebuild. url -> (etag, parsed banners)
+_ETAG_CACHE: Dict[str, Tuple[str, List['Banner']]] = {}
+
+
+def _parse_wiki_date(s: str) -> datetime:
+    # The wiki dates are always DATE_FORMAT ("%Y/%m/%d %H:%M", 16 chars), so
+    # direct slicing beats strptime, which re-interprets the format per call.
+    return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]))
+
+
+@dataclass(frozen=True, slots=True)
 class Banner:
     image_url: str
     units: Tuple[str, ...]
@@ -24,15 +62,23 @@ class Banner:
     end: datetime
     source: str
     release_type: str
+    # Built once per banner so unit-set comparisons in the offset/merge loops
+    # are a single frozenset equality instead of two fresh set() constructions.
+    _unitset: frozenset = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, '_unitset', frozenset(self.units))
 
-    def matches_units(self, other_units: Tuple[str, ...]) -> bool:
-        return set(self.units) == set(other_units)
+    def matches_units(self, other_units) -> bool:
+        if not isinstance(other_units, frozenset):
+            other_units = frozenset(other_units)
+        return self._unitset == other_units
 
     def matches(self, other: 'Banner') -> bool:
-        return self.matches_units(other.units) and self.release_type == other.release_type
+        return self._unitset == other._unitset and self.release_type == other.release_type
 
 
-@dataclass
+@dataclass(slots=True)
 class MergedBanner:
     units: Tuple[str, ...]
     image_url: str
@@ -45,63 +91,161 @@ class MergedBanner:
     global_is_predicted: bool = False
     community_score: Optional[float] = None
     sentiment_count: int = 0
-
-    @property
-    def start_str_asia(self) -> str:
-        return self.asia_start.strftime('%Y-%m-%d') if self.asia_start else "N/A"
-
-    @property
-    def end_str_asia(self) -> str:
-        return self.asia_end.strftime('%Y-%m-%d') if self.asia_end else "N/A"
-
-    @property
-    def start_str_global(self) -> str:
-        if not self.global_start: return "N/A"
-        suffix = " (Predicted)" if self.global_is_predicted else ""
-        return self.global_start.strftime('%Y-%m-%d') + suffix
-
-    @property
-    def end_str_global(self) -> str:
-        if not self.global_end: return "N/A"
+    unit_key: str = ""  # precomputed " ".join(units); every request path needs it
+    sentiment_cache_key: str = ""
+    search_blob: str = ""  # lowercase haystack of every searchable field, built at load time
+    start_str_asia: str = "N/A"
+    end_str_asia: str = "N/A"
+    start_str_global: str = "N/A"
+    end_str_global: str = "N/A"
+
+    def format_date_strings(self):
+        """Materialize the UI date strings. They are pure functions of fields
+        that never change after the merge, yet the templates and search blob
+        read them repeatedly - strftime once instead of per access."""
+        if self.asia_start:
+            self.start_str_asia = self.asia_start.strftime('%Y-%m-%d')
+        if self.asia_end:
+            self.end_str_asia = self.asia_end.strftime('%Y-%m-%d')
         suffix = " (Predicted)" if self.global_is_predicted else ""
-        return self.global_end.strftime('%Y-%m-%d') + suffix
+        if self.global_start:
+            self.start_str_global = self.global_start.strftime('%Y-%m-%d') + suffix
+        if self.global_end:
+            self.end_str_global = self.global_end.strftime('%Y-%m-%d') + suffix
 
     def matches_query(self, query: str) -> bool:
-        query = query.lower()
-
-        if query in ", ".join(self.units).lower():
-            return True
-
-        if query in self.start_str_asia.lower(): return True
-        if query in self.end_str_asia.lower(): return True
-        if query in self.start_str_global.lower(): return True
-        if query in self.end_str_global.lower(): return True
-
-        if query in self.asia_type.lower(): return True
-        if query in self.global_type.lower(): return True
-
-        return False
+        # Caller passes an already-lowercased query; one C-level substring
+        # search over the precomputed blob replaces seven field checks.
+        return query in self.search_blob
 
 
 class BannerManager:
     def __init__(self):
         self.merged_banners: List[MergedBanner] = []
         self._time_offset: Optional[timedelta] = None
+        self._query_cache: Dict[str, List[MergedBanner]] = {}
+        self._trigram_index: Dict[str, set] = {}  # search-blob 3-gram -> banner indices
+        self.data_version = 0  # bumped on every successful load; used for HTTP ETags
+        self._session = requests.Session()  # keep-alive: both wiki pages share one TLS connection
+        self._session.headers.update(HEADERS)
+        # Both pages load concurrently, so pool enough connections for that
+        # burst; everything goes to the one wiki host.
+        self._session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+    def close(self):
+        self._session.close()
 
     @staticmethod
-    def _fetch_html(url: str) -> str:
-        response = requests.get(url, headers=HEADERS)
+    def _banner_cache_path(source: str) -> str:
+        return os.path.join(BANNER_CACHE_DIR, f"bluearchive_banners_{source.lower()}.pkl")
+
+    def _load_banners(self, url: str, source: str) -> List[Banner]:
+        """
+        Fetch and parse one banner page, with an on-disk (etag, banners)
+        cache: when the wiki answers 304 Not Modified we skip both the
+        download and the parse and reuse the pickled Banner list.
+        """
+        path = self._banner_cache_path(source)
+        cached_etag, cached_banners = _ETAG_CACHE.get(url, (None, None))
+        if cached_banners is None:
+            try:
+                with open(path, "rb") as f:
+                    cached_etag, cached_banners = pickle.load(f)
+            except (OSError, pickle.PickleError, EOFError, ValueError):
+                pass
+
+        headers = {}
+        if cached_etag and cached_banners is not None:
+            headers["If-None-Match"] = cached_etag
+
+        response = self._session.get(url, timeout=10, headers=headers)
+        if response.status_code == 304 and cached_banners is not None:
+            print(f"✅ {source} page unchanged (ETag hit), reusing parsed banner cache.")
+            _ETAG_CACHE[url] = (cached_etag, cached_banners)
+            return cached_banners
         response.raise_for_status()
-        return response.text
+
+        banners = self._parse_banners(response.text, source)
+
+        etag = response.headers.get("ETag")
+        if etag:
+            _ETAG_CACHE[url] = (etag, banners)
+            try:
+                os.makedirs(BANNER_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump((etag, banners), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)  # atomic swap; readers never see a torn file
+            except OSError as e:
+                print(f"Warning: could not write banner cache for {source}: {e}", file=sys.stderr)
+        return banners
 
     @staticmethod
     def _parse_banners(html: str, source: str) -> List[Banner]:
-        soup = BeautifulSoup(html, "html.parser")
+        table_fragments = _WIKITABLE_RE.findall(html)
+        if table_fragments:
+            html = "".join(table_fragments)
+
+        banners = BannerManager._parse_banners_fast(html, source)
+        if banners:
+            return banners
+        return BannerManager._parse_banners_soup(html, source)
+
+    @staticmethod
+    def _parse_banners_fast(html: str, source: str) -> List[Banner]:
+        """
+        Regex scanner specialized to the fixed row shape of the banner tables:
+        the column order, the rerun marker and the date format are all static,
+        so plain string scanning replaces DOM construction entirely. Returns []
+        when the markup does not match (wiki layout change); _parse_banners
+        then falls back to the BeautifulSoup path.
+        """
+        banners: List[Banner] = []
+        interned_source = sys.intern(source)
+
+        for row_match in _TR_RE.finditer(html):
+            row_attrs, row_body = row_match.group(1), row_match.group(2)
+            cells = _TD_SPLIT_RE.split(row_body)
+            if len(cells) < 4: continue  # header row (<th>) or malformed
+
+            release_match = _RELEASE_RE.search(row_attrs)
+            release_type = release_match.group(1) if release_match else 'unknown'
+
+            img_match = _IMG_SRC_RE.search(cells[1])
+            img_url = "https:" + img_match.group(1) if img_match else "N/A"
+
+            units_list = [sys.intern(unescape(text).strip())
+                          for text in _ANCHOR_TEXT_RE.findall(cells[2]) if text.strip()]
+            if not units_list:
+                # _ANCHOR_TEXT_RE only sees plain-text anchors; nested markup
+                # yields nothing, and a unit-less banner is useless downstream.
+                continue
+
+            small_match = _SMALL_RE.search(cells[2])
+            if small_match and 'rerun' in small_match.group(1).lower():
+                release_type = 'rerun'
+
+            date_match = _DATE_RANGE_RE.search(unescape(cells[3]))
+            if not date_match:
+                continue
+            try:
+                start = _parse_wiki_date(date_match.group(1))
+                end = _parse_wiki_date(date_match.group(2))
+            except ValueError:
+                continue  # regex checks shape only; skip out-of-range values
+
+            banners.append(Banner(img_url, tuple(units_list), start, end,
+                                  interned_source, sys.intern(release_type)))
+        return banners
+
+    @staticmethod
+    def _parse_banners_soup(html: str, source: str) -> List[Banner]:
+        soup = BeautifulSoup(html, "lxml")  # C parser; same tree, several times faster than html.parser
         rows = soup.select("table.wikitable tr")[1:]
         banners: List[Banner] = []
 
         for row in rows:
-            cols = row.select('td')
+            cols = row.find_all('td', limit=3)  # only three cells are used; stop walking there
             if len(cols) < 3: continue
 
             release_type = row.get('data-release', 'unknown')
@@ -109,23 +253,33 @@ class BannerManager:
             img_tag = cols[0].find("img")
             img_url = "https:" + img_tag.get("src") if img_tag and img_tag.get("src") else "N/A"
 
-            unit_cell = cols[1]
-            units_list = [a.get_text(strip=True) for a in unit_cell.find_all("a") if a.get_text(strip=True)]
-
-            rerun_tag = unit_cell.find('small')
-            if rerun_tag and 'rerun' in rerun_tag.get_text(strip=True).lower():
-                release_type = 'rerun'
-
-            date_text = cols[2].get_text(strip=True)
-
+            # One descendant walk over the unit cell classifies the name links
+            # and the rerun marker together instead of two separate traversals.
+            # Unit names repeat across rows and across the Asia/Global pages;
+            # interning makes every duplicate share one string object.
+            units_list = []
+            for el in cols[1].find_all(['a', 'small']):
+                text = el.get_text(strip=True)
+                if el.name == 'a':
+                    if text:
+                        units_list.append(sys.intern(text))
+                elif 'rerun' in text.lower():
+                    release_type = 'rerun'
+
+            # Same precompiled range regex as the fast path; it only checks
+            # shape, so out-of-range values (month 13 etc.) still need the
+            # per-row guard - one bad cell must not abort the whole page.
+            date_match = _DATE_RANGE_RE.search(cols[2].get_text(strip=True))
+            if not date_match:
+                continue
             try:
-                start_str, end_str = date_text.split("—")
-                start = datetime.strptime(start_str.strip(), DATE_FORMAT)
-                end = datetime.strptime(end_str.strip(), DATE_FORMAT)
-            except Exception:
+                start = _parse_wiki_date(date_match.group(1))
+                end = _parse_wiki_date(date_match.group(2))
+            except ValueError:
                 continue
 
-            banners.append(Banner(img_url, tuple(units_list), start, end, source, release_type))
+            banners.append(Banner(img_url, tuple(units_list), start, end,
+                                  sys.intern(source), sys.intern(release_type)))
         return banners
 
     def _calculate_offset(self, asia: List[Banner], global_list: List[Banner]):
@@ -136,20 +290,22 @@ class BannerManager:
 
         last_global_banner = max(global_list, key=lambda b: b.start)
 
-        asia_match = None
+        target_units = last_global_banner._unitset
 
-        for b in reversed(asia):
-            if b.matches_units(last_global_banner.units) and b.release_type == last_global_banner.release_type:
-                asia_match = b
-                break
+        # One forward pass builds both lookup tables; later banners overwrite
+        # earlier ones, so each dict holds the most recent occurrence - the
+        # same banner the old reversed() scans found first.
+        exact_idx: Dict[Tuple[frozenset, str], Banner] = {}
+        units_idx: Dict[frozenset, Banner] = {}
+        for b in asia:
+            exact_idx[(b._unitset, b.release_type)] = b
+            units_idx[b._unitset] = b
 
+        asia_match = exact_idx.get((target_units, last_global_banner.release_type))
         if not asia_match:
             print(
                 f"Warning: Could not find exact type match for {last_global_banner.units}. Falling back to unit-only match.")
-            for b in reversed(asia):
-                if b.matches_units(last_global_banner.units):
-                    asia_match = b
-                    break
+            asia_match = units_idx.get(target_units)
 
         if asia_match:
             self._time_offset = last_global_banner.start - asia_match.start
@@ -184,9 +340,25 @@ class BannerManager:
 
         final_list: List[MergedBanner] = []
 
-        global_banners_copy = list(global_list)
+        # Index Global banners once so each Asia banner resolves its match in
+        # O(1) instead of rescanning the whole Global list twice (exact pass
+        # plus unit-only fallback). Deques keep the original first-match order.
+        exact_idx: Dict[Tuple[frozenset, str], deque] = defaultdict(deque)
+        units_idx: Dict[frozenset, deque] = defaultdict(deque)
+        for i, b_global in enumerate(global_list):
+            key_units = b_global._unitset
+            exact_idx[(key_units, b_global.release_type)].append(i)
+            units_idx[key_units].append(i)
+
         used_global_banners = set()
 
+        def pop_unused(candidates: Optional[deque]) -> Optional[int]:
+            while candidates:
+                i = candidates.popleft()
+                if i not in used_global_banners:
+                    return i
+            return None
+
         for b_asia in asia:
             merged = MergedBanner(
                 units=b_asia.units,
@@ -196,33 +368,18 @@ class BannerManager:
                 asia_type=b_asia.release_type
             )
 
-            found_global_match = False
-            for i, b_global in enumerate(global_banners_copy):
-                if i in used_global_banners:
-                    continue
-
-                if b_asia.matches(b_global):
-                    merged.global_start = b_global.start
-                    merged.global_end = b_global.end
-                    merged.global_type = b_global.release_type
-                    used_global_banners.add(i)
-                    found_global_match = True
-                    break
-
-            if not found_global_match:
-                for i, b_global in enumerate(global_banners_copy):
-                    if i in used_global_banners:
-                        continue
-
-                    if b_asia.matches_units(b_global.units):
-                        merged.global_start = b_global.start
-                        merged.global_end = b_global.end
-                        merged.global_type = b_global.release_type
-                        used_global_banners.add(i)
-                        found_global_match = True
-                        break
-
-            if not found_global_match and self._time_offset:
+            key_units = b_asia._unitset
+            match_i = pop_unused(exact_idx.get((key_units, b_asia.release_type)))
+            if match_i is None:
+                match_i = pop_unused(units_idx.get(key_units))
+
+            if match_i is not None:
+                b_global = global_list[match_i]
+                merged.global_start = b_global.start
+                merged.global_end = b_global.end
+                merged.global_type = b_global.release_type
+                used_global_banners.add(match_i)
+            elif self._time_offset:
                 merged.global_start = b_asia.start + self._time_offset
                 merged.global_end = b_asia.end + self._time_offset
                 merged.global_is_predicted = True
@@ -230,7 +387,7 @@ class BannerManager:
 
             final_list.append(merged)
 
-        for i, b_global in enumerate(global_banners_copy):
+        for i, b_global in enumerate(global_list):
             if i not in used_global_banners:
                 final_list.append(MergedBanner(
                     units=b_global.units,
@@ -242,30 +399,85 @@ class BannerManager:
 
         print("Finalizing merge (sentiment analysis skipped for async update)...")
 
-        def get_sort_date(banner: MergedBanner):
-            return banner.global_start or banner.asia_start or datetime.min
-
-        return sorted(final_list, key=get_sort_date, reverse=True)
+        # Decorate-sort: extract the sort dates in one comprehension and let
+        # the C-level itemgetter drive the sort, keeping the Python closure
+        # out of the key path.
+        decorated = [(mb.global_start or mb.asia_start or datetime.min, mb)
+                     for mb in final_list]
+        decorated.sort(key=itemgetter(0), reverse=True)
+        return [mb for _, mb in decorated]
 
     def load_data(self):
         print("🔄 Loading banner data...")
         try:
-            asia_html = self._fetch_html(ASIA_URL)
-            global_html = self._fetch_html(GLOBAL_URL)
+            # The two pages are independent round-trips; fetch them together.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                asia_future = executor.submit(self._load_banners, ASIA_URL, "Asia")
+                global_future = executor.submit(self._load_banners, GLOBAL_URL, "Global")
+                asia_banners = asia_future.result()
+                global_banners = global_future.result()
         except requests.HTTPError as e:
             print(f"❌ HTTP Error loading data: {e}", file=sys.stderr)
             return
 
-        asia_banners = self._parse_banners(asia_html, "Asia")
-        global_banners = self._parse_banners(global_html, "Global")
-
         self._calculate_offset(asia_banners, global_banners)
         self.merged_banners = self._merge_and_predict_data(asia_banners, global_banners)
+
+        for banner in self.merged_banners:
+            banner.unit_key = " ".join(banner.units)
+            banner.sentiment_cache_key = f"sentiment_data:{banner.unit_key}"
+            banner.format_date_strings()
+            banner.search_blob = " | ".join((
+                ", ".join(banner.units),
+                banner.start_str_asia, banner.end_str_asia,
+                banner.start_str_global, banner.end_str_global,
+                banner.asia_type, banner.global_type,
+            )).lower()
+
+        trigram_index: Dict[str, set] = defaultdict(set)
+        for i, banner in enumerate(self.merged_banners):
+            blob = banner.search_blob
+            for j in range(len(blob) - 2):
+                trigram_index[blob[j:j + 3]].add(i)
+        self._trigram_index = dict(trigram_index)
+
+        self._query_cache.clear()
+        self.data_version = int(time.time())
         print(f"✅ Data merged. {len(self.merged_banners)} unique banners found.\n")
 
+    def _filter_by_trigrams(self, query: str) -> List[MergedBanner]:
+        """Intersect the posting sets of every query trigram: a banner missing
+        any of them cannot contain the query. Survivors still get the exact
+        substring check, since trigram containment is necessary but not
+        sufficient. Sorting the indices preserves the merged display order."""
+        candidates: Optional[set] = None
+        for j in range(len(query) - 2):
+            postings = self._trigram_index.get(query[j:j + 3])
+            if not postings:
+                return []
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                return []
+
+        merged = self.merged_banners
+        return [merged[i] for i in sorted(candidates) if query in merged[i].search_blob]
+
     def get_filtered_banners(self, query: str) -> List[MergedBanner]:
         if not query:
             return self.merged_banners
 
         query_lower = query.lower()
-        return [b for b in self.merged_banners if b.matches_query(query_lower)]
+        cached = self._query_cache.get(query_lower)
+        if cached is not None:
+            return cached
+
+        if len(query_lower) >= 3:
+            result = self._filter_by_trigrams(query_lower)
+        else:
+            # Too short for trigrams; the linear scan is cheap at this length.
+            result = [b for b in self.merged_banners if b.matches_query(query_lower)]
+
+        if len(self._query_cache) >= QUERY_CACHE_SIZE:
+            self._query_cache.clear()
+        self._query_cache[query_lower] = result
+        return result